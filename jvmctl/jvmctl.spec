@@ -54,6 +54,7 @@ fi
 
 %files
 %defattr(644,root,root,755)
+%attr(755, root, root) %{_bindir}/hprof
 %attr(755, root, root) %{_bindir}/hsperf
 %attr(755, root, root) %{_bindir}/jvmctl
 %attr(644, root, root) /etc/bash_completion.d/jvmctl
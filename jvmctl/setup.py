@@ -23,6 +23,7 @@ setup(
         'console_scripts': [
             'jvmctl=jvmctl.jvmctl:main',
             'hsperf=jvmctl.hsperf:main',
+            'hprof=jvmctl.hprof:main',
       ],
     },
     data_files = [
@@ -0,0 +1,13 @@
+import os
+from importlib.machinery import SourceFileLoader
+from importlib.util import spec_from_loader, module_from_spec
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "jvmctl")
+
+
+def load_script(name):
+    """Load one of the extensionless scripts in jvmctl/ as a module"""
+    loader = SourceFileLoader(name, os.path.join(SCRIPTS, name))
+    module = module_from_spec(spec_from_loader(name, loader))
+    loader.exec_module(module)
+    return module
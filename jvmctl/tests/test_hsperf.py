@@ -0,0 +1,139 @@
+import io, os, shutil, struct, tempfile, unittest
+from ctypes import addressof, c_long, memmove
+from unittest import mock
+
+from . import load_script
+
+hsperf = load_script("hsperf")
+
+STRING_SIZE = 32
+
+
+def perf_entry(name, value, unit):
+    """A hsperfdata v2 entry: a long counter for an int value, else a
+    string with room for STRING_SIZE bytes"""
+    nameb = name.encode() + b"\0"
+    if isinstance(value, int):
+        data, dtype, vlen = struct.pack("<q", value), b"J", 0
+    else:
+        data, dtype, vlen = value.encode().ljust(STRING_SIZE, b"\0"), b"B", STRING_SIZE
+    data_offset = (20 + len(nameb) + 7) & ~7
+    body = nameb.ljust(data_offset - 20, b"\0") + data
+    length = (20 + len(body) + 7) & ~7
+    header = struct.pack("<iiicbbbi", length, 20, vlen, dtype, 0, unit, 3, data_offset)
+    return (header + body).ljust(length, b"\0")
+
+
+def perf_file(filename, counters):
+    body = b"".join(perf_entry(*counter) for counter in counters)
+    header = struct.pack(
+        "<IbbbbiiqII", 0xC0C0FECA, 1, 2, 0, 1, 32 + len(body), 0, 0, 32, len(counters)
+    )
+    with open(filename, "wb") as f:
+        f.write(header + body + b"\0" * 256)
+
+
+COUNTERS = [
+    ("sun.os.hrt.frequency", 1000000000, hsperf.UNIT_HERTZ),
+    ("sun.gc.cause", "No GC", hsperf.UNIT_STRING),
+    ("java.threads.live", 42, hsperf.UNIT_EVENTS),
+    ("sun.gc.generation.0.space.0.used", 0, hsperf.UNIT_BYTES),
+]
+
+START = 1700000000.0
+
+
+class RecordingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("hsperf-test")
+        filename = os.path.join(self.tmpdir, "perf")
+        perf_file(filename, COUNTERS)
+        self.data = hsperf.PerfData.from_file(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def set(self, name, value):
+        """Change a counter in the mapped copy, as the JVM would"""
+        entry = self.data[name]
+        address = addressof(entry) + entry.data_offset
+        if entry.vector_length:
+            value = value.encode().ljust(STRING_SIZE, b"\0")
+            memmove(address, value, STRING_SIZE)
+        else:
+            c_long.from_address(address).value = value
+
+    def record(self, samples):
+        """Record each sample (a dict of counter changes) a quarter second
+        apart and return the recording"""
+        f = io.BytesIO()
+        times = [START + i * 0.25 for i in range(len(samples))]
+        with mock.patch.object(hsperf.time, "time", side_effect=times):
+            recorder = hsperf.Recorder(f, self.data)
+            for sample in samples:
+                for name, value in sample.items():
+                    self.set(name, value)
+                recorder.record()
+        return f.getvalue()
+
+    def replay(self, buf):
+        """Each replayed sample as (time, dict of name => value)"""
+        return [
+            (data.time, dict((entry.name, entry.value) for entry in data))
+            for data in hsperf.replay(buf)
+        ]
+
+    def expected(self, samples):
+        values = dict((name, value) for name, value, unit in COUNTERS)
+        result = []
+        for i, sample in enumerate(samples):
+            values.update(sample)
+            result.append((START + i * 0.25, dict(values)))
+        return result
+
+    def test_round_trip(self):
+        used = "sun.gc.generation.0.space.0.used"
+        samples = [
+            {},
+            {used: 2 ** 62},
+            {used: -1, "java.threads.live": 41},
+            {used: -(2 ** 62), "sun.gc.cause": "Allocation Failure"},
+            {used: 300, "sun.gc.cause": "No GC"},
+            {},
+        ]
+        self.assertEqual(self.replay(self.record(samples)), self.expected(samples))
+
+    def test_truncated_recording(self):
+        samples = [{}, {"java.threads.live": 7}, {"java.threads.live": 1000}]
+        buf = self.record(samples)
+        self.assertEqual(self.replay(buf[:-1]), self.expected(samples[:2]))
+
+    def test_not_a_recording(self):
+        with self.assertRaises(ValueError):
+            list(hsperf.replay(b"JAVA PROFILE 1.0.2\0"))
+
+    def test_format_is_stable(self):
+        """Old recordings must stay readable: this is the encoding of a
+        known recording, so a format change breaks it here first"""
+        samples = [{}, {"java.threads.live": 41, "sun.gc.generation.0.space.0.used": 300}]
+        self.assertEqual(self.record(samples), RECORDING)
+        self.assertEqual(self.replay(RECORDING), self.expected(samples))
+
+
+RECORDING = (
+    b"HSPERFREC1\n"
+    # header: start time, 4 entries of name, unit, kind (and string value)
+    b"H\x00\x00\x00@\xfcT\xd9A\x04"
+    b"\x14sun.os.hrt.frequency\x06J"
+    b"\x0csun.gc.cause\x05B\x05No GC"
+    b"\x11java.threads.live\x04J"
+    b" sun.gc.generation.0.space.0.used\x02J"
+    # first sample: 0ms, 2 changes from zero as (slot gap, zigzag delta)
+    b"S\x00\x02\x00\x80\xa8\xd6\xb9\x07\x01T"
+    # second sample: 250ms, threads -1 and used +300
+    b"S\xfa\x01\x02\x01\x01\x01\xd8\x04"
+)
+
+
+if __name__ == "__main__":
+    unittest.main()
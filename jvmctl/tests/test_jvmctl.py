@@ -0,0 +1,437 @@
+import configparser, contextlib, datetime, io, os, random, re, shutil, stat
+import tarfile, tempfile, unittest, zipfile
+from types import SimpleNamespace
+from unittest import mock
+
+from . import load_script
+
+jvmctl = load_script("jvmctl")
+
+
+def write(filename, content, mode=0o644):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        f.write(content)
+    os.chmod(filename, mode)
+
+
+class TempDirTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp("jvmctl-test")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, *parts):
+        return os.path.join(self.tmpdir, *parts)
+
+
+class ReleaseStoreTest(TempDirTest):
+    def setUp(self):
+        super().setUp()
+        self.node = SimpleNamespace(name="app", apps_path=self.path("apps", "app"))
+        os.makedirs(self.path("apps"))
+        self.store = jvmctl.ReleaseStore(self.node, self.path("releases"))
+
+    def build(self, name, files):
+        """A build output tree of relative path => content or (content, mode)"""
+        target = self.path("build", name)
+        for rel, content in files.items():
+            content, mode = content if isinstance(content, tuple) else (content, 0o644)
+            write(os.path.join(target, rel), content, mode)
+        return target
+
+    def stored(self, release, rel):
+        return os.stat(os.path.join(self.store.dir, release, rel))
+
+    def test_add_and_activate(self):
+        files = {"app.jar": "jar", "bin/run": ("#!/bin/sh\n", 0o755)}
+        self.assertEqual(self.store.add(self.build("1", files), "20240101000000"), 13)
+        self.store.activate("20240101000000")
+        self.assertEqual(self.store.current(), "20240101000000")
+        self.assertEqual(self.store.releases(), ["20240101000000"])
+        with open(os.path.join(self.node.apps_path, "app.jar")) as f:
+            self.assertEqual(f.read(), "jar")
+        self.assertEqual(stat.S_IMODE(self.stored("20240101000000", "bin/run").st_mode), 0o555)
+
+    def test_objects_are_shared_and_read_only(self):
+        self.store.add(self.build("1", {"a": "same", "b": "old"}), "1")
+        written = self.store.add(self.build("2", {"a": "same", "b": "new"}), "2")
+        self.assertEqual(written, 3)
+        self.assertEqual(self.stored("1", "a").st_ino, self.stored("2", "a").st_ino)
+        self.assertNotEqual(self.stored("1", "b").st_ino, self.stored("2", "b").st_ino)
+        self.assertEqual(self.stored("2", "a").st_mode & 0o222, 0)
+
+    def test_same_size_and_mtime_is_still_hashed(self):
+        first = self.build("1", {"a": "one"})
+        self.store.add(first, "1")
+        second = self.build("2", {"a": "two"})
+        st = os.stat(os.path.join(first, "a"))
+        os.utime(os.path.join(second, "a"), (st.st_atime, st.st_mtime))
+        self.store.add(second, "2")
+        with open(os.path.join(self.store.dir, "2", "a")) as f:
+            self.assertEqual(f.read(), "two")
+
+    def test_mode_is_part_of_the_object(self):
+        self.store.add(self.build("1", {"a": ("x", 0o644), "b": ("x", 0o755)}), "1")
+        self.assertNotEqual(self.stored("1", "a").st_ino, self.stored("1", "b").st_ino)
+
+    def test_activate_keeps_a_legacy_tree(self):
+        write(os.path.join(self.node.apps_path, "old.jar"), "old")
+        self.store.add(self.build("1", {"new.jar": "new"}), "20240101000000")
+        self.store.activate("20240101000000")
+        self.assertTrue(os.path.islink(self.node.apps_path))
+        legacy = [n for n in self.store.releases() if n != "20240101000000"]
+        self.assertEqual(len(legacy), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.store.dir, legacy[0], "old.jar")))
+
+    def test_prune_keeps_current_and_drops_unlinked_objects(self):
+        for name in ["1", "2", "3"]:
+            self.store.add(self.build(name, {"a": name}), name)
+        self.store.activate("1")
+        self.store.prune(1)
+        self.assertEqual(self.store.releases(), ["1", "3"])
+        objects = [fn for dirpath, dirs, fns in os.walk(self.store.objects) for fn in fns]
+        self.assertEqual(len(objects), 2)
+
+
+class UnpackWarTest(TempDirTest):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = os.path.realpath(self.tmpdir)
+        patcher = mock.patch.object(jvmctl, "RELEASES_ROOT", self.path("releases"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.node = SimpleNamespace(name="app", apps_path=self.path("app"))
+        self.store = jvmctl.ReleaseStore(self.node)
+
+    def war(self, name, entries):
+        war = self.path(name + ".war")
+        with zipfile.ZipFile(war, "w") as zf:
+            for entry, content in entries.items():
+                info = zipfile.ZipInfo(entry, (2024, 1, 1, 0, 0, 0))
+                info.external_attr = 0o644 << 16
+                zf.writestr(info, content)
+        return war
+
+    def deploy(self, name, entries):
+        target = self.path("target-" + name, "ROOT")
+        previous = os.path.join(self.node.apps_path, "ROOT")
+        result = jvmctl.unpack_war(self.war(name, entries), target, previous)
+        self.store.add(os.path.dirname(target), name)
+        self.store.activate(name)
+        return result
+
+    def stored(self, release, rel):
+        return os.path.join(self.store.dir, release, "ROOT", rel)
+
+    def test_first_unpack_writes_everything(self):
+        self.assertEqual(self.deploy("1", {"a.class": "aaaa", "WEB-INF/b.xml": "b"}), (2, 5, 0))
+
+    def test_unchanged_entries_link_to_the_previous_release(self):
+        self.deploy("1", {"a.class": "aaaa", "b.class": "bbbb"})
+        self.assertEqual(self.deploy("2", {"a.class": "aaaa", "b.class": "BBBB"}), (1, 4, 1))
+        self.assertEqual(
+            os.stat(self.stored("1", "a.class")).st_ino, os.stat(self.stored("2", "a.class")).st_ino
+        )
+        with open(self.stored("2", "b.class")) as f:
+            self.assertEqual(f.read(), "BBBB")
+
+    def test_unsafe_entry_is_rejected(self):
+        with self.assertRaises(OSError):
+            jvmctl.unpack_war(self.war("evil", {"../x": "x"}), self.path("t"), self.node.apps_path)
+
+
+class CheckTarMemberTest(TempDirTest):
+    def member(self, name, type=tarfile.REGTYPE, linkname=""):
+        member = tarfile.TarInfo(name)
+        member.type = type
+        member.linkname = linkname
+        return member
+
+    def check(self, *args):
+        jvmctl.check_tar_member(self.member(*args), self.tmpdir)
+
+    def assertRejected(self, *args):
+        with self.assertRaises(ValueError):
+            self.check(*args)
+
+    def test_plain_members(self):
+        self.check("jetty/bin/jetty.sh")
+        self.check("jetty/lib", tarfile.DIRTYPE)
+        self.check("jetty/./lib/../start.jar")
+
+    def test_paths_out_of_the_tree(self):
+        self.assertRejected("/etc/passwd")
+        self.assertRejected("../escape")
+        self.assertRejected("jetty/../../escape")
+
+    def test_links_inside_the_tree(self):
+        self.check("jetty/bin/jetty", tarfile.SYMTYPE, "jetty.sh")
+        self.check("jetty/current", tarfile.SYMTYPE, "../jetty")
+        self.check("jetty/start", tarfile.LNKTYPE, "jetty/start.jar")
+
+    def test_links_out_of_the_tree(self):
+        self.assertRejected("jetty/etc", tarfile.SYMTYPE, "/etc")
+        self.assertRejected("jetty/up", tarfile.SYMTYPE, "../..")
+        self.assertRejected("jetty/passwd", tarfile.LNKTYPE, "/etc/passwd")
+        self.assertRejected("jetty/passwd", tarfile.LNKTYPE, "../etc/passwd")
+
+    def test_writing_through_an_extracted_link(self):
+        os.symlink("/etc", self.path("etc"))
+        self.assertRejected("etc/cron.d/evil")
+        self.assertRejected("etc-link", tarfile.SYMTYPE, "etc/cron.d")
+
+    def test_special_files(self):
+        self.assertRejected("jetty/dev", tarfile.CHRTYPE)
+        self.assertRejected("jetty/fifo", tarfile.FIFOTYPE)
+
+
+THREAD_DUMP_JDK17 = """\
+2024-06-10 12:00:00
+Full thread dump OpenJDK 64-Bit Server VM (17.0.11+9 mixed mode):
+
+"main" #1 prio=5 os_prio=0 cpu=120.50ms elapsed=10.00s tid=0x00007f nid=0x1a2b runnable  [0x00007f]
+   java.lang.Thread.State: RUNNABLE
+\tat java.io.FileInputStream.readBytes(java.base@17.0.11/Native Method)
+\tat com.example.Main.main(Main.java:10)
+
+"GC Thread#0" os_prio=0 cpu=5.00ms elapsed=10.00s tid=0x00007f nid=0x1a2c runnable
+
+"qtp-1 (busy)" #20 daemon prio=5 os_prio=0 tid=0x00007f nid=0x1a30 waiting on condition
+   java.lang.Thread.State: TIMED_WAITING (parking)
+\tat jdk.internal.misc.Unsafe.park(java.base@17.0.11/Native Method)
+\t- parking to wait for  <0x00000000c0000000>
+\tat java.util.concurrent.locks.LockSupport.parkNanos(java.base@17.0.11/LockSupport.java:252)
+"""
+
+THREAD_DUMP_JDK21 = """\
+"main" #1 [4242] prio=5 os_prio=0 cpu=1.00ms elapsed=1.00s tid=0x00007f nid=4242 runnable
+   java.lang.Thread.State: RUNNABLE
+\tat com.example.Main.loop(Main.java:20)
+"""
+
+
+class ThreadDumpTest(unittest.TestCase):
+    def test_hex_nids(self):
+        threads = jvmctl.parse_thread_dump(THREAD_DUMP_JDK17)
+        self.assertEqual(sorted(threads), [0x1A2B, 0x1A2C, 0x1A30])
+        self.assertEqual(
+            threads[0x1A2B],
+            ("main", ["java.io.FileInputStream.readBytes", "com.example.Main.main"]),
+        )
+        self.assertEqual(threads[0x1A2C], ("GC Thread#0", []))
+        name, frames = threads[0x1A30]
+        self.assertEqual(name, "qtp-1 (busy)")
+        self.assertEqual(
+            frames, ["jdk.internal.misc.Unsafe.park", "java.util.concurrent.locks.LockSupport.parkNanos"]
+        )
+
+    def test_decimal_nids(self):
+        self.assertEqual(
+            jvmctl.parse_thread_dump(THREAD_DUMP_JDK21),
+            {4242: ("main", ["com.example.Main.loop"])},
+        )
+
+    def test_thread_cpu_ticks(self):
+        ticks = jvmctl.thread_cpu_ticks(os.getpid())
+        self.assertIn(os.getpid(), ticks)
+        self.assertTrue(all(n >= 0 for n in ticks.values()))
+
+
+def synthetic_log(seed, lines=400):
+    """A day's log in logduct's format with the odd unstamped line (stack
+    traces, wrapped output) and runs of lines sharing a stamp"""
+    rng = random.Random(seed)
+    millis = rng.randrange(1000)
+    out = []
+    for i in range(lines):
+        if rng.random() < 0.2:
+            out.append(b"\tat com.example.Thing.run(Thing.java:%d)\n" % i)
+            continue
+        millis += rng.choice([0, 0, 1, 250, 60000])
+        stamp = "%02d:%02d:%02d.%03d" % (
+            millis // 3600000 % 24, millis // 60000 % 60, millis // 1000 % 60, millis % 1000
+        )
+        out.append(stamp.encode() + b" java[1]: line %d\n" % i)
+    return b"".join(out)
+
+
+def brute_force_offset(buf, stamp, lo=0):
+    pos = 0
+    for line in buf.splitlines(True):
+        if pos >= lo and jvmctl.LOG_STAMP.match(line) and line[:12] >= stamp:
+            return pos
+        pos += len(line)
+    return len(buf)
+
+
+class LogSearchTest(TempDirTest):
+    def test_log_offset_matches_brute_force(self):
+        for seed in range(20):
+            buf = synthetic_log(seed)
+            stamps = sorted(set(re.findall(rb"^\d\d:\d\d:\d\d\.\d\d\d", buf, re.M)))
+            probes = stamps + [b"00:00:00.000", b"23:59:59.999"]
+            for stamp in probes[::7] + probes[-2:]:
+                expected = brute_force_offset(buf, stamp)
+                self.assertEqual(jvmctl.log_offset(buf, stamp), expected, (seed, stamp))
+                lo = brute_force_offset(buf, stamp[:6] + b"00.000")
+                self.assertEqual(
+                    jvmctl.log_offset(buf, stamp, lo), brute_force_offset(buf, stamp, lo)
+                )
+
+    def test_log_offset_of_empty_and_unstamped_logs(self):
+        self.assertEqual(jvmctl.log_offset(b"", b"12:00:00.000"), 0)
+        buf = b"no stamp here\nnor here\n"
+        self.assertEqual(jvmctl.log_offset(buf, b"00:00:00.000"), len(buf))
+
+    def test_chunks_find_every_match_once(self):
+        buf = synthetic_log(1, 2000)
+        filename = self.path("stdio.log")
+        with open(filename, "wb") as f:
+            f.write(buf)
+        pattern = re.compile(rb"line \d*7\b|Thing\.java:1\d\b")
+        expected = b"".join(b"P " + line for line in buf.splitlines(True) if pattern.search(line))
+        with mock.patch.object(jvmctl, "_grep_pattern", pattern):
+            for chunk in [37, 100, 4096, len(buf)]:
+                found = b"".join(
+                    jvmctl.grep_chunk((filename, lo, min(lo + chunk, len(buf)), b"P "))
+                    for lo in range(0, len(buf), chunk)
+                )
+                self.assertEqual(found, expected, chunk)
+
+    def test_parse_log_time(self):
+        now = datetime.datetime(2024, 5, 2, 13, 30, 15)
+        self.assertEqual(jvmctl.parse_log_time("2h", now), datetime.datetime(2024, 5, 2, 11, 30, 15))
+        self.assertEqual(jvmctl.parse_log_time("90s ago", now), datetime.datetime(2024, 5, 2, 13, 28, 45))
+        self.assertEqual(jvmctl.parse_log_time("yesterday", now), datetime.datetime(2024, 5, 1))
+        self.assertEqual(jvmctl.parse_log_time("13:00", now), datetime.datetime(2024, 5, 2, 13, 0))
+        self.assertEqual(
+            jvmctl.parse_log_time("2024-05-01 13:00", now), datetime.datetime(2024, 5, 1, 13, 0)
+        )
+        self.assertEqual(jvmctl.log_stamp(datetime.datetime(2024, 5, 1, 9, 5, 1, 2500)), b"09:05:01.002")
+
+
+class ParseSizeTest(unittest.TestCase):
+    def test_units(self):
+        self.assertEqual(jvmctl.parse_size("0"), 0)
+        self.assertEqual(jvmctl.parse_size("512"), 512)
+        self.assertEqual(jvmctl.parse_size("512m"), 512 << 20)
+        self.assertEqual(jvmctl.parse_size(" 4G "), 4 << 30)
+        self.assertEqual(jvmctl.parse_size("2kb"), 2048)
+        self.assertEqual(jvmctl.parse_size("1t"), 1 << 40)
+
+    def test_invalid(self):
+        for value in ["", "m", "1.5g", "-1m", "10x", "auto"]:
+            with self.assertRaises(ValueError):
+                jvmctl.parse_size(value)
+
+
+def config_node(jvm, service=None, **attrs):
+    """A stand-in for Node with just a config"""
+    config = configparser.RawConfigParser()
+    config.optionxform = str
+    config.read_dict({"jvm": jvm, "systemd.service.Service": service or {}})
+    return SimpleNamespace(config=config, **attrs)
+
+
+class JvmProfileTest(TempDirTest):
+    def java_home(self, version):
+        home = self.path("jdk-" + version)
+        write(os.path.join(home, "release"), 'IMPLEMENTOR="x"\nJAVA_VERSION="%s"\n' % version)
+        return home
+
+    def test_java_version(self):
+        self.assertEqual(jvmctl.java_version(self.java_home("1.8.0_292")), (8, 292))
+        self.assertEqual(jvmctl.java_version(self.java_home("11.0.22")), (11, 22))
+        self.assertEqual(jvmctl.java_version(self.java_home("21")), (21, 0))
+        self.assertEqual(jvmctl.java_version(self.path("missing")), None)
+
+    def flags(self, profile, version, quota=""):
+        node = config_node(
+            {"HEAP_SIZE": "1g", "GC_LOG_OPTS": ""},
+            {"CPUQuota": quota} if quota else {},
+            log_file="/logs/app/stdio.log",
+        )
+        return [flag for flag, group in jvmctl.profile_flags(node, profile, version)]
+
+    def test_low_latency_collector_by_version(self):
+        self.assertIn("-XX:+UseG1GC", self.flags("low-latency", (11, 0)))
+        self.assertIn("-XX:+UseZGC", self.flags("low-latency", (17, 0)))
+        self.assertNotIn("-XX:+ZGenerational", self.flags("low-latency", (17, 0)))
+        self.assertIn("-XX:+ZGenerational", self.flags("low-latency", (21, 0)))
+        self.assertIn("-XX:+ZGenerational", self.flags("low-latency", (22, 0)))
+        self.assertNotIn("-XX:+ZGenerational", self.flags("low-latency", (23, 0)))
+        self.assertIn("-XX:+UseZGC", self.flags("low-latency", (25, 0)))
+
+    def test_processor_count_only_where_supported(self):
+        self.assertIn("-XX:ActiveProcessorCount=2", self.flags("throughput", (11, 0), "200%"))
+        self.assertIn("-XX:ActiveProcessorCount=2", self.flags("throughput", (8, 191), "200%"))
+        self.assertFalse(
+            [f for f in self.flags("throughput", (8, 181), "200%") if "ActiveProcessor" in f]
+        )
+        self.assertFalse([f for f in self.flags("throughput", (11, 0)) if "ActiveProcessor" in f])
+
+    def test_gc_logging_by_version(self):
+        self.assertTrue(self.flags("small", (11, 0))[-1].startswith("-Xlog:gc*:file=/logs/app/gc.log"))
+        self.assertIn("-Xloggc:/logs/app/gc.log", self.flags("small", (8, 0)))
+
+    def test_small_has_no_pretouch(self):
+        self.assertIn("-XX:+UseSerialGC", self.flags("small", (17, 0)))
+        self.assertNotIn("-XX:+AlwaysPreTouch", self.flags("small", (17, 0)))
+        self.assertIn("-Xms1g", self.flags("throughput", (17, 0)))
+
+    def test_flag_key(self):
+        self.assertEqual(jvmctl.flag_key("-XX:+UseZGC"), "gc")
+        self.assertEqual(jvmctl.flag_key("-XX:-UseParallelGC"), "gc")
+        self.assertEqual(jvmctl.flag_key("-XX:MaxGCPauseMillis=50"), "MaxGCPauseMillis")
+        self.assertEqual(jvmctl.flag_key("-Dfoo.bar=1"), "-Dfoo.bar")
+        self.assertEqual(jvmctl.flag_key("-Xms512m"), "-Xms")
+        self.assertEqual(jvmctl.flag_key("-Xlog:gc"), "-Xlog")
+
+
+class JettyTuningTest(TempDirTest):
+    def container(self, **jvm):
+        jvm = dict(
+            {"HEAP_SIZE": "512m", "PORT": "8080", "JETTY_VERSION": "9.4.54", "WEBAPPS_PATH": ""},
+            **jvm
+        )
+        node = config_node(
+            jvm,
+            {"CPUQuota": "400%"},
+            name="app",
+            basedir=self.path("base"),
+            apps_path=self.path("apps"),
+            config_file="/etc/jvmctl/apps/app.conf",
+        )
+        os.makedirs(node.basedir, exist_ok=True)
+        return jvmctl.JettyContainer(node)
+
+    def thread_pool(self, **jvm):
+        self.container(**jvm).configure_jetty9()
+        with open(self.path("base", "http.xml")) as f:
+            xml = f.read()
+        return [int(n) for n in re.findall(r'name="(?:min|max)Threads" type="int">(\d+)<', xml)]
+
+    def test_explicit_settings_ignore_heap_size(self):
+        tuning = self.container(HEAP_SIZE="bogus", JETTY_MAX_THREADS="100").tuning()
+        self.assertEqual(tuning["JETTY_MAX_THREADS"], (100, "configured"))
+        self.assertEqual(tuning["JETTY_MIN_THREADS"], (None, "jetty default"))
+
+    def test_auto_max_threads_is_capped_by_heap(self):
+        tuning = self.container(HEAP_SIZE="64m", JETTY_MAX_THREADS="auto").tuning()
+        self.assertEqual(tuning["JETTY_MAX_THREADS"][0], 32)
+        tuning = self.container(HEAP_SIZE="8g", JETTY_MAX_THREADS="auto").tuning()
+        self.assertEqual(tuning["JETTY_MAX_THREADS"][0], 200)
+
+    def test_explicit_min_raises_the_default_max(self):
+        self.assertEqual(self.thread_pool(JETTY_MIN_THREADS="300"), [300, 300])
+        self.assertEqual(self.thread_pool(JETTY_MAX_THREADS="5"), [5, 5])
+
+    def test_explicit_min_above_explicit_max(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            self.thread_pool(JETTY_MIN_THREADS="50", JETTY_MAX_THREADS="20")
+
+
+if __name__ == "__main__":
+    unittest.main()